@@ -11,27 +11,68 @@
 # --------------------------------------------------------------------
 
 import os
+import sys
 import time
 import json
 import math
+import queue
+import random
+import functools
+import itertools
+import threading
+import collections
+import atexit
+import bisect
+import logging
+import logging.handlers
 import traceback
-from typing import Optional, Tuple, Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Tuple, Dict, Any, List, NamedTuple
 
 import requests
 import MetaTrader5 as mt5
 
+# 자주 쓰는 MT5 상수는 모듈 속성 조회 없이 쓰도록 미리 바인딩
+_BUY = mt5.ORDER_TYPE_BUY
+_SELL = mt5.ORDER_TYPE_SELL
+_POS_BUY = mt5.POSITION_TYPE_BUY
+_POS_SELL = mt5.POSITION_TYPE_SELL
+_DEAL = mt5.TRADE_ACTION_DEAL
+_IOC = mt5.ORDER_FILLING_IOC
+_DONE = mt5.TRADE_RETCODE_DONE
+_CLOSE_BY = mt5.TRADE_ACTION_CLOSE_BY
+_NO_MONEY = mt5.TRADE_RETCODE_NO_MONEY
+# 이 코드들로 거절되면 심볼 매핑 자체가 잘못됐을 수 있어 다시 찾는다
+_RESOLVE_AGAIN_RETCODES = frozenset({
+    mt5.TRADE_RETCODE_INVALID_VOLUME,
+    mt5.TRADE_RETCODE_INVALID,
+    mt5.TRADE_RETCODE_TRADE_DISABLED,
+})
+
+try:
+    import orjson  # C 구현 JSON (없으면 표준 json 사용)
+except ImportError:
+    orjson = None
+
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+# 재시도는 짧게: /pull 이 롱폴이라 재시도가 길어지면 신호 수신 자체가 늦어진다
 _http_retry = Retry(
-    total=5,
-    backoff_factor=0.8,
+    total=2,
+    backoff_factor=0.2,
     status_forcelist=[429, 502, 503, 504],
     allowed_methods=["GET", "POST"],
 )
 _http = requests.Session()
-_http.mount("http://",  HTTPAdapter(max_retries=_http_retry))
-_http.mount("https://", HTTPAdapter(max_retries=_http_retry))
+_http.headers.update({"Connection": "keep-alive"})
+_http.mount("http://",  HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=_http_retry))
+_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=_http_retry))
+
+# 텔레그램은 호스트가 달라 세션을 분리 (서버 커넥션 풀과 섞이지 않게)
+_tg_http = requests.Session()
+_tg_http.headers.update({"Connection": "keep-alive"})
+_tg_http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=_http_retry))
 
 # ============== 환경변수 ==============
 SERVER_URL = os.environ.get("SERVER_URL", "").rstrip("/")
@@ -40,9 +81,32 @@ FIXED_ENTRY_LOT = float(os.environ.get("FIXED_ENTRY_LOT", "0.01"))
 
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID", "")
+# 텔레그램 알림은 이 주기마다 모아서 한 번에 전송 (API 빈도 제한 대비)
+TG_FLUSH_SEC = float(os.environ.get("TG_FLUSH_SEC", "0.5"))
+# 전송 대기 알림 상한. 텔레그램이 막혀도 메모리가 늘지 않게 넘치면 오래된 것부터 버린다
+TG_QUEUE_MAX = max(1, int(os.environ.get("TG_QUEUE_MAX", "64")))
+# 로그 레벨. DEBUG 로 두면 [lot-pick]/[lot-base] 같은 상세 로그도 출력
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").strip().upper() or "INFO"
+# 지연 분포(p50/p95/p99)를 샘플 이 개수마다 로그로. 0 이면 끔
+LATENCY_LOG_EVERY = max(0, int(os.environ.get("LATENCY_LOG_EVERY", "100")))
 
 POLL_INTERVAL_SEC = float(os.environ.get("POLL_INTERVAL_SEC", "1.0"))
+# 숏폴 중 빈 응답이 이어지면 간격을 1.5배씩 늘려 이 값까지 (신호가 오면 바로 원복)
+POLL_INTERVAL_MAX_SEC = float(os.environ.get("POLL_INTERVAL_MAX_SEC", "10.0"))
 MAX_BATCH = int(os.environ.get("MAX_BATCH", "10"))
+# 한 배치 안에서 심볼이 다른 신호를 동시에 처리할 워커 수 (같은 심볼은 순서대로)
+SIGNAL_WORKERS = max(1, int(os.environ.get("SIGNAL_WORKERS", "4")))
+# 브로커 주문 빈도 제한 대비: 1초 창 안에서 이 개수를 넘으면 그때만 잠깐 대기
+MAX_ORDERS_PER_SEC = max(1, int(os.environ.get("MAX_ORDERS_PER_SEC", "10")))
+# /pull 롱폴 대기(ms). 서버가 신호가 올 때까지 응답을 잡고 있는다. 0이면 기존 숏폴
+PULL_WAIT_MS = int(os.environ.get("PULL_WAIT_MS", "25000"))
+# 롱폴이 연속으로 실패하면(프록시가 끊는 등) 이 시간 동안 숏폴로 내려갔다가 다시 시도
+LONG_POLL_RETRY_SEC = float(os.environ.get("LONG_POLL_RETRY_SEC", "300"))
+# MT5 터미널 연결 점검 주기(초). 끊겼으면 재접속 + 캐시 비움
+MT5_WATCHDOG_SEC = float(os.environ.get("MT5_WATCHDOG_SEC", "5.0"))
+MT5_WATCHDOG_MAX_SEC = float(os.environ.get("MT5_WATCHDOG_MAX_SEC", "60.0"))  # 재접속 실패 시 백오프 상한
+# 브로커 심볼 목록(symbols_get) 재조회 주기(초). 심볼 구성은 거의 안 바뀐다
+SYMBOLS_CACHE_TTL_SEC = float(os.environ.get("SYMBOLS_CACHE_TTL_SEC", "300"))
 
 REQUIRE_MARGIN_CHECK = os.environ.get("REQUIRE_MARGIN_CHECK", "0").strip() in ("1", "true", "True", "YES", "yes")
 ALLOW_SPLIT_ENTRIES = os.environ.get("ALLOW_SPLIT_ENTRIES", "1").strip() in ("1", "true", "True", "YES", "yes")
@@ -64,47 +128,27 @@ IGNORE_SIGNAL_CONTRACTS = os.environ.get("IGNORE_SIGNAL_CONTRACTS", "1").strip()
 # - SILVER(XAGUSD 계열) : 0.3
 # - 그 외 : FIXED_ENTRY_LOT (예: 0.3)
 # --------------------------------------------------------------------
-def get_fixed_lot_for_symbol(symbol_hint: str) -> float:
-    key = (symbol_hint or "").strip().upper()
-
-    # 비트코인 계열
-    if key in ("BTCUSD", "BTCUSDT", "XBTUSD"):
-        return 0.05
-
-    # 이더리움 계열
-    if key in ("ETHUSD", "ETHUSDT", "XETUSD", "XETHUSD"):
-        return 2
-
-    # 솔라나 계열
-    if key in ("SOLUSD", "SOLUSDT"):
-        return 0.8
-
-    # 실버(은)
-    if key in ("XAGUSD", "SILVER", "XAGUSD.CASH", "XAGUSDm"):
-        return 0.02
-
-    if key in ("ADAUSD", "ADAUSDT"):
-        return 0.3
-
-    if key in ("DOGUSD", "DOGEUSDT"):
-        return 0.3
-
-    if key in ("BVSPX", "BOVESPA", "IBOV", "IBOVESPA", "BVSPX"):
-        return 0.4
-
-    if key in ("IBEX", "ESP35", "IBEX35", "ES35", "ESP35.cash"):
-        return 1.0
-   
-    if key in ("ASX", "AUS200", "ASX200", "AU200", "AUS200.cash"):
-        return 3.0
-         
-    if key in ("XAUUSD", "GOLD", "XAUUSD.cash", "XAUUSDm", "GC1!"):
-        return 0.1
+# (고정 랏, 심볼들) — 아래에서 대문자 키 → 랏 dict 로 펼쳐 신호마다 O(1) 조회
+_FIXED_LOT_TABLE: List[Tuple[float, Tuple[str, ...]]] = [
+    (0.05, ("BTCUSD", "BTCUSDT", "XBTUSD")),                        # 비트코인 계열
+    (2,    ("ETHUSD", "ETHUSDT", "XETUSD", "XETHUSD")),             # 이더리움 계열
+    (0.8,  ("SOLUSD", "SOLUSDT")),                                  # 솔라나 계열
+    (0.02, ("XAGUSD", "SILVER", "XAGUSD.CASH", "XAGUSDm")),         # 실버(은)
+    (0.3,  ("ADAUSD", "ADAUSDT")),
+    (0.3,  ("DOGUSD", "DOGEUSDT")),
+    (0.4,  ("BVSPX", "BOVESPA", "IBOV", "IBOVESPA")),
+    (1.0,  ("IBEX", "ESP35", "IBEX35", "ES35", "ESP35.cash")),
+    (3.0,  ("ASX", "AUS200", "ASX200", "AU200", "AUS200.cash")),
+    (0.1,  ("XAUUSD", "GOLD", "XAUUSD.cash", "XAUUSDm", "GC1!")),
+    (0.5,  ("NAS100", "US100", "USTEC", "NQ1!")),
+]
+_FIXED_LOT_MAP: Dict[str, float] = {
+    name.upper(): lot for lot, names in _FIXED_LOT_TABLE for name in names
+}
 
-    if key in ("NAS100", "US100", "USTEC", "NQ1!"):
-        return 0.5
-  # 그 외 심볼은 환경변수 FIXED_ENTRY_LOT 사용
-    return FIXED_ENTRY_LOT
+def get_fixed_lot_for_symbol(symbol_hint: str) -> float:
+    # 그 외 심볼은 환경변수 FIXED_ENTRY_LOT 사용
+    return _FIXED_LOT_MAP.get((symbol_hint or "").strip().upper(), FIXED_ENTRY_LOT)
 
 # ===========================
 # 심볼 별칭 (TV → INFINOX MT5)
@@ -182,108 +226,429 @@ FINAL_ALIASES: Dict[str, List[str]] = {
     "EURUSD": ["EURUSD", "EURUSD.m", "EURUSD.micro"],
 }
 
+# 신호 처리용 스레드풀
+EXEC = ThreadPoolExecutor(max_workers=SIGNAL_WORKERS)
+# 텔레그램 알림 대기열 — tg() 는 넣기만 하고(논블로킹), 전송은 _tg_flusher 스레드가 모아서
+_TG_Q: queue.Queue = queue.Queue(maxsize=TG_QUEUE_MAX)
+
+# MT5 파이썬 바인딩은 주문 전송이 스레드 안전하지 않아 order_send 만 직렬화
+_MT5_ORDER_LOCK = threading.Lock()
+# 최근 주문 전송 시각 (빈도 제한용)
+_ORDER_TIMES: collections.deque = collections.deque(maxlen=MAX_ORDERS_PER_SEC)
+
+# 별칭표를 import 시점에 한 번 정리: 대문자 키 → 중복 없는 소문자 별칭 튜플
+_ALIASES_LC: Dict[str, Tuple[str, ...]] = {
+    k.upper(): tuple(dict.fromkeys(a.lower() for a in v)) for k, v in FINAL_ALIASES.items()
+}
+
 # TradingView 기준 마지막 pos_after (심볼별)
 LAST_TV_POS: Dict[str, Optional[float]] = {}
 
 # ===========================
 # 기본 함수 / 유틸
 # ===========================
-def log(msg: str):
-    print(time.strftime("[%Y-%m-%d %H:%M:%S]"), msg, flush=True)
+# 핫패스는 큐에 레코드만 넣고, 포맷/출력은 QueueListener 스레드가 담당
+_LOG_Q: "queue.SimpleQueue" = queue.SimpleQueue()
+
+class _RawQueueHandler(logging.handlers.QueueHandler):
+    """기본 QueueHandler.prepare() 는 호출한 스레드에서 format() 까지 한다 → 레코드를 그대로 넘긴다.
+    (같은 프로세스 큐라 피클링이 필요 없다. 인자는 나중에 포맷되므로 바뀌는 객체는 넘기지 않는다)"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+logger = logging.getLogger("agent")
+logger.addHandler(_RawQueueHandler(_LOG_Q))
+# getLevelName 은 알려진 레벨 이름이면 숫자, 아니면 "Level X" 문자열 → 모르는 값은 INFO
+_level = logging.getLevelName(LOG_LEVEL)
+if not isinstance(_level, int):
+    _level = logging.INFO
+    LOG_LEVEL = "INFO"
+logger.setLevel(_level)
+logger.propagate = False
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+_log_listener = logging.handlers.QueueListener(_LOG_Q, _log_handler)
+_log_listener.start()
+
+_ERR_PREFIXES = ("[ERR]", "[FATAL]")
+
+def log(msg: str, *args):
+    # 핫패스에서는 log("... %s", x) 형태로 넘겨서, 실제로 찍힐 때만 문자열을 만든다
+    # [ERR]/[FATAL] 은 error, [WARN] 은 warning 레벨 → LOG_LEVEL=WARNING 이어도 오류는 보인다
+    if msg.startswith(_ERR_PREFIXES):
+        logger.error(msg, *args)
+    elif msg.startswith("[WARN]"):
+        logger.warning(msg, *args)
+    else:
+        logger.info(msg, *args)
+
+def log_debug(msg: str, *args):
+    # 레벨에서 걸러지면 큐에 넣지도, 포맷하지도 않는다
+    logger.debug(msg, *args)
+
+# ============== 지연 측정 ==============
+class _Hist:
+    """최근 n개 소요시간(ns) 링버퍼. LATENCY_LOG_EVERY 개마다 분위수를 로그로."""
+
+    def __init__(self, name: str, n: int = 256):
+        self.name = name
+        self.buf = [0] * n
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, ns: int):
+        snap = None
+        with self.lock:
+            self.buf[self.count % len(self.buf)] = ns
+            self.count += 1
+            if LATENCY_LOG_EVERY and self.count % LATENCY_LOG_EVERY == 0:
+                snap = sorted(self.buf[:min(self.count, len(self.buf))])
+        if snap:
+            def q(p: float) -> float:
+                return snap[min(len(snap) - 1, int(p * len(snap)))] / 1e6
+            log("[lat] %s n=%s p50=%.1fms p95=%.1fms p99=%.1fms", self.name, self.count, q(0.50), q(0.95), q(0.99))
+
+_H_ORDER = _Hist("order_send")
+_H_CLOSE_BY = _Hist("close_by")
+_H_PULL = _Hist("pull")   # 롱폴은 대기시간이 섞이므로 숏폴(wait_ms=0)만 기록
+_H_ACK = _Hist("ack")
+
+# 큐가 넘쳐 버린 알림 수 (다음 전송 때 "N건 누락" 으로 알려 주고 0으로)
+_TG_DROPPED = 0
+_TG_DROP_LOCK = threading.Lock()
 
 def tg(message: str):
+    global _TG_DROPPED
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
         return
     try:
-        requests.post(
+        _TG_Q.put_nowait(message)
+        return
+    except queue.Full:
+        pass
+    # 가득 차면 제일 오래된 알림을 버리고 새 알림을 넣는다 (최신 체결 상태가 더 중요)
+    try:
+        dropped = _TG_Q.get_nowait()
+    except queue.Empty:
+        dropped = None
+    try:
+        _TG_Q.put_nowait(message)
+    except queue.Full:
+        dropped = message
+    if dropped is not None:
+        with _TG_DROP_LOCK:
+            _TG_DROPPED += 1
+            n = _TG_DROPPED
+        log("[WARN] tg queue full, drop oldest #%s: %s", n, dropped)
+
+def _take_tg_dropped() -> int:
+    global _TG_DROPPED
+    with _TG_DROP_LOCK:
+        n, _TG_DROPPED = _TG_DROPPED, 0
+    return n
+
+# 텔레그램 한 메시지 최대 길이
+_TG_MAX_LEN = 4000
+
+def _tg_flush(first: Optional[str] = None):
+    """쌓인 알림을 줄바꿈으로 이어 최대한 적은 sendMessage 로 보낸다."""
+    buf: List[str] = []
+    size = 0
+    dropped = _take_tg_dropped()
+    if dropped:
+        buf.append(f"⚠️ {dropped} notification(s) dropped (queue full)")
+        size = len(buf[0]) + 1
+    msg = first
+    while True:
+        if msg is None:
+            try:
+                msg = _TG_Q.get_nowait()
+            except queue.Empty:
+                break
+        if buf and size + len(msg) + 1 > _TG_MAX_LEN:
+            _tg_send("\n".join(buf))
+            buf, size = [], 0
+        buf.append(msg)
+        size += len(msg) + 1
+        msg = None
+    if buf:
+        _tg_send("\n".join(buf))
+
+def _tg_flusher():
+    while True:
+        first = _TG_Q.get()          # 알림이 없으면 여기서 잠든다
+        time.sleep(TG_FLUSH_SEC)     # 그 사이 들어온 알림까지 한 번에
+        _tg_flush(first)
+
+def _tg_send(message: str):
+    try:
+        _tg_http.post(
             f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
-            json={"chat_id": TELEGRAM_CHAT_ID, "text": message},
+            data=_json_dumps({"chat_id": TELEGRAM_CHAT_ID, "text": message}),
+            headers=_JSON_HEADERS,
             timeout=10,
         )
     except Exception as e:
-        print("[TG ERR]", e, flush=True)
+        log("[TG ERR] %s", e)
+
+if TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID:
+    threading.Thread(target=_tg_flusher, name="tg-flush", daemon=True).start()
+# 종료 시 남은 알림/로그를 비우고 나간다 (등록 역순: 알림 먼저, 로그 나중)
+atexit.register(_log_listener.stop)
+atexit.register(_tg_flush)
 
 def ensure_mt5_initialized() -> bool:
     try:
         if not mt5.initialize():
-            log(f"[ERR] MT5 initialize failed: {mt5.last_error()}")
+            log("[ERR] MT5 initialize failed: %s", mt5.last_error())
             return False
         acct = mt5.account_info()
         if not acct:
             log("[ERR] MT5 account_info None")
             return False
-        log(f"MT5 ok: {acct.login}, {acct.company}")
+        log("MT5 ok: %s, %s", acct.login, acct.company)
         return True
     except Exception:
-        log("[ERR] MT5 initialize exception:\n" + traceback.format_exc())
+        log("[ERR] MT5 initialize exception:\n%s", traceback.format_exc())
         return False
 
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+def _json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def _json_loads(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 def post_json(path: str, payload: dict, timeout: float = 20.0) -> dict:
     url = f"{SERVER_URL}{path}"
     try:
-        r = _http.post(url, json=payload, timeout=timeout, headers={"Connection": "keep-alive"})
+        r = _http.post(url, data=_json_dumps(payload), headers=_JSON_HEADERS, timeout=timeout)
         r.raise_for_status()
-        return r.json()
+        return _json_loads(r.content)
     except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectTimeout) as e:
-        log(f"[WARN] post_json timeout {path}: {e}")
+        log("[WARN] post_json timeout %s: %s", path, e)
         return {}
     except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.HTTPError) as e:
-        log(f"[WARN] post_json conn/http err {path}: {e}")
+        log("[WARN] post_json conn/http err %s: %s", path, e)
         return {}
     except Exception as e:
-        log(f"[ERR] post_json fatal {path}: {e}")
+        log("[ERR] post_json fatal %s: %s", path, e)
         return {}
 
 def get_health() -> dict:
     try:
         r = _http.get(f"{SERVER_URL}/health", timeout=5)
         r.raise_for_status()
-        return r.json()
+        return _json_loads(r.content)
     except Exception:
         return {}
 
+# ============== 심볼 정보 캐시 ==============
+# symbol_info 는 터미널 IPC 라 신호 하나에 5~8번씩 부르면 지연이 쌓인다.
+# - _SYMBOL_DYN    : (조회시각, info) → visible/호가가 바뀌므로 짧은 TTL
+# - _SYMBOL_STATIC : (step, min, max) → 세션 중 사실상 불변이라 영구 보관
+SYMBOL_INFO_TTL_SEC = 0.5
+_SYMBOL_DYN: Dict[str, Tuple[float, Any]] = {}
+_SYMBOL_STATIC: Dict[str, Tuple[float, float, float]] = {}
+# 이번 프로세스에서 Market Watch 에 올라온 것을 확인한 심볼
+_SELECTED: set = set()
+
+def ensure_visible(symbol: str) -> bool:
+    if symbol in _SELECTED:
+        return True
+    if mt5.symbol_select(symbol, True):
+        _SELECTED.add(symbol)
+        return True
+    # 선택 실패 = 브로커 목록에서 빠졌거나 이름이 바뀌었을 수 있음 → 목록을 다시 받게
+    invalidate_symbols_cache()
+    return False
+
+def get_symbol_info(symbol: str):
+    now = time.monotonic()
+    hit = _SYMBOL_DYN.get(symbol)
+    if hit and now - hit[0] < SYMBOL_INFO_TTL_SEC:
+        return hit[1]
+    info = mt5.symbol_info(symbol)
+    if info and info.visible:
+        _SELECTED.add(symbol)
+    elif info:
+        # 터미널에서 숨겨졌을 수 있으니 선택 기록을 지우고 다시 올린다
+        _SELECTED.discard(symbol)
+        if ensure_visible(symbol):
+            info = mt5.symbol_info(symbol)
+    if info:
+        _SYMBOL_DYN[symbol] = (now, info)
+    return info
+
+def get_symbol_steps(symbol: str) -> Tuple[float, float, float]:
+    """(volume_step, volume_min, volume_max) — 최초 1회만 조회."""
+    hit = _SYMBOL_STATIC.get(symbol)
+    if hit:
+        return hit
+    info = get_symbol_info(symbol)
+    step = (info and info.volume_step) or 0.01
+    vol_min = (info and info.volume_min) or step
+    vol_max = (info and info.volume_max) or 0.0
+    if info:
+        _SYMBOL_STATIC[symbol] = (step, vol_min, vol_max)
+    return step, vol_min, vol_max
+
+class SymCtx(NamedTuple):
+    """신호 하나를 처리하는 동안 쓰는 심볼 고정 정보 (가격은 주문 시점에 따로 조회)."""
+    name: str
+    step: float
+    vol_min: float
+    vol_max: float
+
+def symbol_ctx(symbol: str) -> SymCtx:
+    return SymCtx(symbol, *get_symbol_steps(symbol))
+
+def invalidate_symbol_info(symbol: str):
+    _SYMBOL_DYN.pop(symbol, None)
+    _TICK.pop(symbol, None)
+
+# 주문 가격만 필요할 때는 필드 수가 적은 symbol_info_tick 을 아주 짧게 캐시
+TICK_TTL_SEC = 0.05
+_TICK: Dict[str, Tuple[float, Any]] = {}
+
+def get_tick(symbol: str):
+    now = time.monotonic()
+    hit = _TICK.get(symbol)
+    if hit and now - hit[0] < TICK_TTL_SEC:
+        return hit[1]
+    tick = mt5.symbol_info_tick(symbol)
+    if tick:
+        _TICK[symbol] = (now, tick)
+        return tick
+    # 틱이 없으면(선택 전 등) symbol_info 로 대체 — ask/bid 필드는 동일
+    return get_symbol_info(symbol)
+
 # ============== 심볼 필터( .crp 차단 ) ==============
-def is_blocked_symbol(name: str) -> bool:
-    """BTCUSD.crp 같은 심볼은 여기서 막는다."""
-    return ".crp" in name.lower()
+# BTCUSD.crp 같은 심볼은 브로커 심볼 캐시에 넣을 때(_symbols_cache) 소문자 이름으로 걸러낸다
+_BLOCKED_MARK = ".crp"
+
+# ============== 브로커 심볼 목록 캐시 ==============
+# symbols_get() 은 심볼 전체(수백~수천 개)를 IPC 로 받아오므로 TTL 동안 재사용.
+# (이름, 소문자 이름) 쌍으로 보관해서 후보 탐색 때 .lower() 를 반복하지 않는다.
+# 완전일치용으로 소문자 이름 → 원래 이름들 인덱스도 같이 만든다.
+_SYMBOLS: Tuple[float, Tuple[Tuple[str, str], ...], Dict[str, Tuple[str, ...]]] = (0.0, (), {})
+
+# 못 찾은 심볼 때문에 강제 재조회할 때 최소 간격 (없는 심볼 신호가 반복돼도 IPC 폭주 방지)
+SYMBOLS_MISS_REFRESH_SEC = 10.0
+
+def _symbols_cache(force: bool = False):
+    global _SYMBOLS
+    ts, names, _ = _SYMBOLS
+    now = time.monotonic()
+    if names and not force and now - ts < SYMBOLS_CACHE_TTL_SEC:
+        return _SYMBOLS
+    # 소문자 변환은 한 번만: 차단 판정도 같은 소문자 이름으로
+    pairs = ((s.name, s.name.lower()) for s in (mt5.symbols_get() or ()))
+    fresh = tuple(p for p in pairs if _BLOCKED_MARK not in p[1])
+    by_lower: Dict[str, list] = {}
+    for name, nm in fresh:
+        by_lower.setdefault(nm, []).append(name)
+    _SYMBOLS = (now, fresh, {k: tuple(v) for k, v in by_lower.items()})
+    if fresh != names:
+        # 심볼 구성이 바뀌었으면 부분일치용 문자열과 후보 캐시도 다시 만든다
+        _rebuild_name_blob(fresh)
+        _build_candidate_symbols.cache_clear()
+        alias_matches.cache_clear()
+    return _SYMBOLS
+
+# 부분일치 검색용: 소문자 이름 전체를 "\n" 으로 이은 문자열 + 각 이름의 시작 위치.
+# 패턴마다 파이썬 루프로 수천 번 `in` 하는 대신 str.find(C 구현)로 한 번 훑는다.
+_NAME_BLOB: Tuple[str, List[int], Tuple[str, ...]] = ("", [], ())
+
+def _rebuild_name_blob(pairs: Tuple[Tuple[str, str], ...]):
+    global _NAME_BLOB
+    starts: List[int] = []
+    pos = 0
+    for _, nm in pairs:
+        starts.append(pos)
+        pos += len(nm) + 1
+    _NAME_BLOB = ("\n".join(nm for _, nm in pairs), starts, tuple(name for name, _ in pairs))
+
+def find_symbols_containing(pat_lower: str) -> Tuple[str, ...]:
+    """소문자 이름에 pat_lower 가 들어 있는 심볼들 (브로커 목록 순서)."""
+    _symbols_cache()
+    blob, starts, originals = _NAME_BLOB
+    if not pat_lower:
+        return originals
+    hits: List[str] = []
+    i = blob.find(pat_lower)
+    while i != -1:
+        k = bisect.bisect_right(starts, i) - 1
+        hits.append(originals[k])
+        # 같은 이름 안의 두 번째 매치는 건너뛰고 다음 이름부터
+        nxt = starts[k + 1] if k + 1 < len(starts) else len(blob)
+        i = blob.find(pat_lower, nxt)
+    return tuple(hits)
+
+def find_exact_symbols(name_lower: str) -> Tuple[str, ...]:
+    return _symbols_cache()[2].get(name_lower, ())
+
+def invalidate_symbols_cache():
+    """다음 조회 때 symbols_get() 을 다시 하도록 표시 (최근에 받았으면 무시)."""
+    global _SYMBOLS
+    ts, names, by_lower = _SYMBOLS
+    if time.monotonic() - ts >= SYMBOLS_MISS_REFRESH_SEC:
+        _SYMBOLS = (0.0, names, by_lower)
+
+def refresh_symbols_on_miss() -> bool:
+    """후보를 하나도 못 찾았을 때 목록을 새로 받아 본다. 목록이 바뀌었으면 True."""
+    ts, names, _ = _SYMBOLS
+    if time.monotonic() - ts < SYMBOLS_MISS_REFRESH_SEC:
+        return False
+    return _symbols_cache(force=True)[1] != names
 
 # ===========================
 # 심볼 탐색
 # ===========================
-def build_candidate_symbols(requested_symbol: str) -> List[str]:
-    req = (requested_symbol or "").strip()
+# TV 요청 심볼(대문자) → 실제 주문이 나간 브로커 심볼
+_RESOLVED: Dict[str, str] = {}
+
+def invalidate_resolved(mt5_symbol: str):
+    # 워커 스레드들이 동시에 _RESOLVED 에 쓰므로 스냅샷(list)을 떠서 훑는다
+    for k in [k for k, v in list(_RESOLVED.items()) if v == mt5_symbol]:
+        _RESOLVED.pop(k, None)
+
+def build_candidate_symbols(requested_symbol: str) -> Tuple[str, ...]:
+    req = (requested_symbol or "").strip().upper()
     if not req:
-        return []
+        return ()
+    # lru 캐시 적중 전에 목록 TTL/무효화를 먼저 확인 (목록이 바뀌었으면 여기서 lru 가 비워짐)
+    _symbols_cache()
+    return _build_candidate_symbols(req)
+
+@functools.lru_cache(maxsize=128)
+def _build_candidate_symbols(req: str) -> Tuple[str, ...]:
     req_l = req.lower()
-    all_syms = mt5.symbols_get() or []
-    all_syms = [s for s in all_syms if not is_blocked_symbol(s.name)]
-
-    exact = [s.name for s in all_syms if s.name.lower() == req_l]
-    partial = []
-    if not exact:
-        for s in all_syms:
-            if req_l in s.name.lower():
-                partial.append(s.name)
-
-    alias_partials = []
-    aliases = FINAL_ALIASES.get(req.upper(), [])
-    for al in aliases:
-        al_l = al.lower()
-        for s in all_syms:
-            nm = s.name.lower()
-            if nm == al_l or al_l in nm:
-                alias_partials.append(s.name)
-
-    ordered = exact + partial + alias_partials
-    seen = set()
-    return [x for x in ordered if not (x in seen or seen.add(x))]
-
-def detect_open_symbol_from_candidates(candidates: List[str]) -> Optional[str]:
+
+    exact = find_exact_symbols(req_l)
+    partial = () if exact else find_symbols_containing(req_l)
+
+    # dict.fromkeys: 순서를 유지하는 중복 제거
+    return tuple(dict.fromkeys(itertools.chain(exact, partial, alias_matches(req))))
+
+@functools.lru_cache(maxsize=128)
+def alias_matches(key: str) -> Tuple[str, ...]:
+    """별칭표 키(대문자) → 별칭이 부분일치하는 심볼들 (중복 제거, 목록이 바뀌면 캐시 비움)."""
+    # 별칭은 부분일치가 완전일치를 포함하므로 부분일치 한 번으로 충분
+    return tuple(dict.fromkeys(name for al_l in _ALIASES_LC.get(key, ()) for name in find_symbols_containing(al_l)))
+
+def detect_open_symbol_from_candidates(candidates: Tuple[str, ...]) -> Optional[str]:
+    # 후보는 build_candidate_symbols 에서 오므로 .crp 는 이미 빠져 있다
+    if not candidates:
+        return None
+    by_sym = positions_by_symbol()
     for sym in candidates:
-        if is_blocked_symbol(sym):
-            continue
-        poss = mt5.positions_get(symbol=sym)
-        if poss and len(poss) > 0:
+        if by_sym.get(sym):
             return sym
     return None
 
@@ -300,58 +665,135 @@ def detect_any_open_from_alias_pool() -> Optional[str]:
     return None
 
 # ============== 보조 ==============
+# 랏 계산은 "step 의 정수배" 로 한다: x/step 을 정수 칸 수로 바꾼 뒤 정수로 올림/내림하고,
+# 마지막에 step 의 소수 자릿수로 한 번만 되돌린다 → 0.3/0.1=2.9999… 같은 FP 잔차 제거
+@functools.lru_cache(maxsize=64)
+def _step_digits(step: float) -> int:
+    txt = f"{step:.10f}".rstrip("0")
+    return len(txt.split(".")[1]) if "." in txt else 0
+
+def _to_units(x: float, step: float) -> float:
+    return round(x / step, 9)
+
+def _from_units(n: int, step: float) -> float:
+    return round(n * step, _step_digits(step))
+
 def ceil_to_step(x: float, step: float) -> float:
     if step <= 0:
         return x
-    return math.ceil(x / step) * step
+    return _from_units(math.ceil(_to_units(x, step)), step)
 
 def floor_to_step(x: float, step: float) -> float:
     if step <= 0:
         return x
-    return math.floor(x / step) * step
-
-# ============== 랏 결정 ==============
-def _decide_lot_no_margin(info, base_lot: float) -> float:
-    step = info.volume_step or 0.01
-    vol_min = info.volume_min or step
-    vol_max = info.volume_max or 0.0
+    return _from_units(math.floor(_to_units(x, step)), step)
 
-    desired = max(vol_min, base_lot)
-    lot = ceil_to_step(desired, step)
+def floor_units(x: float, step: float) -> int:
+    """x 안에 들어가는 step 칸 수 (내림). 차감 루프는 이 정수로 계산."""
+    return max(0, math.floor(_to_units(x, step)))
 
+# ============== 랏 결정 ==============
+def normalize_volume(symbol: str, volume: float) -> float:
+    """step 올림 + min/max 클램프. 캐시된 step 만 쓰므로 IPC 없음."""
+    step, vol_min, vol_max = get_symbol_steps(symbol)
+    lot = ceil_to_step(max(vol_min, volume), step)
     if vol_max and lot > vol_max:
         lot = floor_to_step(vol_max, step)
-
     return max(vol_min, lot)
 
-def _decide_lot_with_margin(symbol: str, info, base_lot: float) -> float:
-    step = info.volume_step or 0.01
-    vol_min = info.volume_min or step
-    vol_max = info.volume_max or 0.0
+def _decide_lot_no_margin(symbol: str, base_lot: float) -> float:
+    return normalize_volume(symbol, base_lot)
+
+# (심볼, 랏, 가격 구간) → (계산시각, 필요 증거금). 같은 종목·같은 랏·비슷한 가격이면
+# order_calc_margin IPC 를 건너뛰고, 판단은 매번 새 free margin 과 비교한다.
+# 증거금은 가격에 따라 달라지므로 가격을 유효숫자 4자리(±0.05% 안쪽)로 묶어 키에 넣는다.
+MARGIN_CACHE_TTL_SEC = 60.0
+MARGIN_CACHE_MAX = 512
+_MARGIN_CACHE: Dict[Tuple[str, float, float], Tuple[float, Optional[float]]] = {}
+
+def _price_bucket(price: float) -> float:
+    return float(f"{price:.4g}")
+
+# account_info 도 IPC → 연속 진입 판단 사이에는 250ms 동안 재사용. 체결되면 바로 무효화
+ACCOUNT_TTL_SEC = 0.25
+_ACCT: Tuple[float, Any] = (0.0, None)
+
+def get_account_info():
+    global _ACCT
+    now = time.monotonic()
+    ts, acct = _ACCT
+    if acct is not None and now - ts < ACCOUNT_TTL_SEC:
+        return acct
+    acct = mt5.account_info()
+    _ACCT = (now, acct)
+    return acct
+
+def invalidate_account_info():
+    global _ACCT
+    _ACCT = (0.0, None)
+
+def _calc_margin(symbol: str, qty: float, price: float) -> Optional[float]:
+    key = (symbol, qty, _price_bucket(price))
+    now = time.monotonic()
+    hit = _MARGIN_CACHE.get(key)
+    if hit and now - hit[0] < MARGIN_CACHE_TTL_SEC:
+        return hit[1]
+    m = mt5.order_calc_margin(_BUY, symbol, qty, price)
+    if m is None:
+        m = mt5.order_calc_margin(_SELL, symbol, qty, price)
+    if m is not None:
+        # 가격이 움직이면 구간 키가 계속 늘어나므로 상한을 넘으면 통째로 비운다
+        if len(_MARGIN_CACHE) >= MARGIN_CACHE_MAX:
+            _MARGIN_CACHE.clear()
+        _MARGIN_CACHE[key] = (now, m)
+    return m
 
-    desired = max(vol_min, base_lot)
-    lot = ceil_to_step(desired, step)
+def _decide_lot_with_margin(symbol: str, info, base_lot: float) -> float:
+    step, vol_min, _ = get_symbol_steps(symbol)
+    test = normalize_volume(symbol, base_lot)
 
     price = info.ask or info.bid
-    acct = mt5.account_info()
+    acct = get_account_info()
     free = (acct and acct.margin_free) or 0.0
 
     def enough(qty: float) -> bool:
         if not price:
             return True
-        m = mt5.order_calc_margin(mt5.ORDER_TYPE_BUY, symbol, qty, price)
-        if m is None:
-            m = mt5.order_calc_margin(mt5.ORDER_TYPE_SELL, symbol, qty, price)
+        m = _calc_margin(symbol, qty, price)
         return (m is None) or (free >= m)
 
-    test = lot
-    if vol_max and test > vol_max:
-        test = floor_to_step(vol_max, step)
-
-    while test >= vol_min and not enough(test):
-        test = round(floor_to_step(test - step, step), 10)
+    if not price or enough(test):
+        return max(vol_min, test)
+
+    # 들어가는 최대 칸 수를 정수 칸 [vol_min, test) 구간에서 찾는다 (test 는 이미 안 들어감)
+    lo = math.ceil(_to_units(vol_min, step))
+    hi = floor_units(test, step) - 1
+    best = None
+
+    # 증거금은 대부분 랏에 비례 → step 1칸 증거금으로 들어갈 칸 수를 먼저 어림한다
+    m1 = _calc_margin(symbol, step, price)
+    if m1 and m1 > 0:
+        n_fit = min(hi, math.floor(free / m1))
+        if n_fit < lo:
+            return vol_min
+        if enough(_from_units(n_fit, step)):
+            # 고정분이 있는 증거금이면 어림보다 더 들어갈 수 있다 → 한 칸 더 들어가면 위쪽을 탐색
+            if n_fit >= hi or not enough(_from_units(n_fit + 1, step)):
+                return max(vol_min, _from_units(n_fit, step))
+            best, lo = n_fit + 1, n_fit + 2
+        else:
+            hi = n_fit - 1
+
+    # 비례하지 않는 종목(구간별 증거금 등): 증거금은 랏에 대해 단조 증가하므로 이분 탐색 (calc 호출 O(log n))
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if enough(_from_units(mid, step)):
+            best = mid
+            lo = mid + 1
+        else:
+            hi = mid - 1
 
-    return max(vol_min, test)
+    return vol_min if best is None else max(vol_min, _from_units(best, step))
 
 def pick_best_symbol_and_lot(requested_symbol: str, base_lot: float) -> Tuple[Optional[str], Optional[float]]:
     if not requested_symbol:
@@ -359,60 +801,127 @@ def pick_best_symbol_and_lot(requested_symbol: str, base_lot: float) -> Tuple[Op
     else:
         req = requested_symbol
     req = req.strip()
-    req_l = req.lower()
+    key = req.upper()
 
-    all_syms = mt5.symbols_get() or []
-    all_syms = [s for s in all_syms if not is_blocked_symbol(s.name)]
-
-    cand = []
-
-    for s in all_syms:
-        if s.name.lower() == req_l:
-            cand.append(s.name)
-    if not cand:
-        for s in all_syms:
-            if req_l in s.name.lower():
-                cand.append(s.name)
-    if not cand:
-        for a in FINAL_ALIASES.get(req.upper(), []):
-            a_l = a.lower()
-            for s in all_syms:
-                nm = s.name.lower()
-                if nm == a_l or a_l in nm:
-                    cand.append(s.name)
-
-    seen = set()
-    cand = [x for x in cand if not (x in seen or seen.add(x))]
-
-    for sym in cand:
-        info = mt5.symbol_info(sym)
-        if not info:
-            continue
-        if not info.visible:
-            mt5.symbol_select(sym, True)
-            info = mt5.symbol_info(sym)
-            if not info or not info.visible:
-                continue
+    cached = _RESOLVED.get(key)
+    names = (cached,) if cached else _iter_symbol_names(key)
 
+    for sym, info in _iter_tradable_candidates(names):
         if REQUIRE_MARGIN_CHECK:
             lot = _decide_lot_with_margin(sym, info, base_lot)
         else:
-            lot = _decide_lot_no_margin(info, base_lot)
+            lot = _decide_lot_no_margin(sym, base_lot)
 
-        step = info.volume_step or 0.01
-        vol_min = info.volume_min or step
-        log(f"[lot-pick] sym={sym} step={step} min={vol_min} base={base_lot} => lot={lot}")
+        step, vol_min, _ = get_symbol_steps(sym)
+        log_debug("[lot-pick] sym=%s step=%s min=%s base=%s => lot=%s", sym, step, vol_min, base_lot, lot)
+        _RESOLVED[key] = sym
         return sym, lot
 
+    if cached:
+        _RESOLVED.pop(key, None)
+        return pick_best_symbol_and_lot(requested_symbol, base_lot)
+    if refresh_symbols_on_miss():
+        # 캐시 이후 브로커에 새로 생긴 심볼일 수 있다
+        return pick_best_symbol_and_lot(requested_symbol, base_lot)
     return None, None
 
+def _iter_symbol_names(key: str):
+    """완전일치 → (없으면) 부분일치 → (없으면) 별칭 부분일치 순으로 심볼명을 하나씩 낸다.
+    key 는 대문자로 정규화된 요청 심볼 (별칭표 키와 같은 형태)."""
+    req_l = key.lower()
+    exact = find_exact_symbols(req_l)
+    if exact:
+        yield from exact
+        return
+    partial = find_symbols_containing(req_l)
+    if partial:
+        yield from partial
+        return
+    yield from alias_matches(key)
+
+def _iter_tradable_candidates(names):
+    """심볼명마다 symbol_info 를 한 번만 보고, 주문 가능한(visible) 것만 (이름, info) 로 낸다."""
+    for sym in names:
+        info = get_symbol_info(sym)
+        if info and info.visible:
+            yield sym, info
+
 # ============== 포지션/주문 ==============
+# positions_get 도 터미널 IPC → 짧은 TTL 로 캐시하고, 우리 주문이 체결되면 바로 무효화
+POSITIONS_TTL_SEC = 0.2
+_POS_CACHE: Dict[str, Tuple[float, tuple]] = {}
+# 배치 시작 시 positions_get() 한 번으로 받아 둔 전체 스냅샷 (조회시각, {심볼: 포지션들})
+_POS_SNAPSHOT: Tuple[float, Dict[str, tuple]] = (0.0, {})
+
+def prefetch_positions():
+    by_sym: Dict[str, list] = {}
+    for p in (mt5.positions_get() or ()):
+        by_sym.setdefault(p.symbol, []).append(p)
+    global _POS_SNAPSHOT
+    _POS_SNAPSHOT = (time.monotonic(), {k: tuple(v) for k, v in by_sym.items()})
+
+def positions_by_symbol() -> Dict[str, tuple]:
+    """{심볼: 포지션들}. 여러 후보 심볼을 훑을 때 심볼마다 IPC 하지 않고 전체 1회로."""
+    snap_ts, snap = _POS_SNAPSHOT
+    if time.monotonic() - snap_ts < POSITIONS_TTL_SEC:
+        return snap
+    prefetch_positions()
+    return _POS_SNAPSHOT[1]
+
+def get_positions(symbol: str) -> tuple:
+    now = time.monotonic()
+    hit = _POS_CACHE.get(symbol)
+    if hit and now - hit[0] < POSITIONS_TTL_SEC:
+        return hit[1]
+    snap_ts, snap = _POS_SNAPSHOT
+    if now - snap_ts < POSITIONS_TTL_SEC:
+        return snap.get(symbol, ())
+    poss = tuple(mt5.positions_get(symbol=symbol) or ())
+    _POS_CACHE[symbol] = (now, poss)
+    return poss
+
+def invalidate_positions(symbol: str):
+    global _POS_SNAPSHOT
+    _POS_CACHE.pop(symbol, None)
+    _POS_SNAPSHOT = (0.0, {})
+
+# MetaTrader5 파이썬 패키지에는 비동기 주문(OrderSendAsync)이 없다.
+# 모든 주문은 여기 한 곳을 지나가게 해서, 실패 시 캐시 무효화도 여기서 처리.
+def _throttle_orders():
+    # 평소엔 대기 0, 1초 안에 MAX_ORDERS_PER_SEC 개를 이미 보냈을 때만 남은 시간만큼 대기
+    now = time.monotonic()
+    if len(_ORDER_TIMES) == _ORDER_TIMES.maxlen and now - _ORDER_TIMES[0] < 1.0:
+        time.sleep(1.0 - (now - _ORDER_TIMES[0]))
+        now = time.monotonic()
+    _ORDER_TIMES.append(now)
+
+def _order_send(req: dict):
+    with _MT5_ORDER_LOCK:
+        _throttle_orders()
+        t0 = time.perf_counter_ns()
+        r = mt5.order_send(req)
+        _H_ORDER.add(time.perf_counter_ns() - t0)
+    symbol = req.get("symbol", "")
+    if r and r.retcode == _DONE:
+        invalidate_positions(symbol)
+        invalidate_account_info()
+    else:
+        invalidate_symbol_info(symbol)
+        if r and r.retcode in _RESOLVE_AGAIN_RETCODES:
+            invalidate_resolved(symbol)
+    return r
+
 def get_position(symbol: str) -> Tuple[str, float]:
-    poss = mt5.positions_get(symbol=symbol)
+    poss = get_positions(symbol)
     if not poss:
         return "flat", 0.0
-    vL = sum(p.volume for p in poss if p.type == mt5.POSITION_TYPE_BUY)
-    vS = sum(p.volume for p in poss if p.type == mt5.POSITION_TYPE_SELL)
+    # 포지션 수가 보통 몇 개 안 돼서 numpy 변환보다 한 번 훑는 루프가 빠르다
+    vL = vS = 0.0
+    for p in poss:
+        if p.type == _POS_BUY:
+            vL += p.volume
+        elif p.type == _POS_SELL:
+            vS += p.volume
     if vL > 0 and vS == 0:
         return "long", vL
     if vS > 0 and vL == 0:
@@ -422,35 +931,47 @@ def get_position(symbol: str) -> Tuple[str, float]:
         return "flat", 0.0
     return ("long" if net > 0 else "short"), abs(net)
 
-def _send_deal(symbol: str, side: str, volume: float) -> tuple:
-    info = mt5.symbol_info(symbol)
-    if not info or not info.visible:
-        mt5.symbol_select(symbol, True)
-        info = mt5.symbol_info(symbol)
-    order_type = mt5.ORDER_TYPE_BUY if side == "buy" else mt5.ORDER_TYPE_SELL
-    price = info.ask if side == "buy" else info.bid
-    req = {
-        "action": mt5.TRADE_ACTION_DEAL,
-        "symbol": symbol,
-        "type": order_type,
-        "volume": volume,
-        "price": price,
-        "deviation": 50,
-        "type_filling": mt5.ORDER_FILLING_IOC,
-    }
-    r = mt5.order_send(req)
-    if r and r.retcode == mt5.TRADE_RETCODE_DONE:
+# 심볼별 DEAL 요청의 고정 필드. 주문마다 .copy() 후 type/volume/price(/position) 만 채운다
+_REQ_TEMPLATE: Dict[str, dict] = {}
+
+def _req_template(symbol: str) -> dict:
+    t = _REQ_TEMPLATE.get(symbol)
+    if t is None:
+        t = {"action": _DEAL, "symbol": symbol, "deviation": 50, "type_filling": _IOC}
+        _REQ_TEMPLATE[symbol] = t
+    return t
+
+def _deal_request(symbol: str, side: str, volume: float, tick) -> dict:
+    req = _req_template(symbol).copy()
+    req["type"] = _BUY if side == "buy" else _SELL
+    req["volume"] = volume
+    req["price"] = tick.ask if side == "buy" else tick.bid
+    return req
+
+def _deal_result(r) -> tuple:
+    if r and r.retcode == _DONE:
         return True, r.retcode, getattr(r, "comment", "")
     return False, getattr(r, "retcode", None), getattr(r, "comment", "")
 
-def send_market_order(symbol: str, side: str, lot: float) -> bool:
-    info = mt5.symbol_info(symbol)
-    if not info or not info.visible:
-        mt5.symbol_select(symbol, True)
-        info = mt5.symbol_info(symbol)
+def _send_deal(symbol: str, side: str, volume: float) -> tuple:
+    tick = get_tick(symbol)
+    return _deal_result(_order_send(_deal_request(symbol, side, volume, tick)))
+
+def _prepare_split_requests(symbol: str, side: str, total: float, piece_vol: float) -> List[dict]:
+    """분할 진입 주문을 한 번에 만들어 둔다(틱 조회 1회)."""
+    tick = get_tick(symbol)
+    # piece_vol 단위 정수 개수만 보낸다 (piece_vol 미만 잔량은 주문 불가라 버림)
+    n_full = math.floor(_to_units(total, piece_vol)) if piece_vol > 0 else 0
+    return [_deal_request(symbol, side, piece_vol, tick) for _ in range(n_full)]
+
+def _submit_all(reqs: List[dict]):
+    """준비된 주문을 사이에 다른 IPC 없이 연달아 전송하고 (req, 결과)를 돌려준다.
+    소비 측에서 break 하면 남은 주문은 보내지 않는다."""
+    for req in reqs:
+        yield req, _deal_result(_order_send(req))
 
-    step = (info and info.volume_step) or 0.01
-    vol_min = (info and info.volume_min) or step
+def send_market_order(symbol: str, side: str, lot: float) -> bool:
+    step, vol_min, _ = get_symbol_steps(symbol)
 
     target = max(vol_min, lot)
     attempt = target
@@ -460,32 +981,29 @@ def send_market_order(symbol: str, side: str, lot: float) -> bool:
         ok, ret, cmt = _send_deal(symbol, side, attempt)
         if ok:
             filled += attempt
-            log(f"[OK] market {side} {attempt} {symbol} (filled={filled}/{target})")
+            log("[OK] market %s %s %s (filled=%s/%s)", side, attempt, symbol, filled, target)
             break
-        log(f"[ERR] order_send ret={ret} {cmt} (try vol={attempt})")
-        if ret == mt5.TRADE_RETCODE_NO_MONEY:
-            attempt = round(floor_to_step(attempt - step, step), 10)
+        log("[ERR] order_send ret=%s %s (try vol=%s)", ret, cmt, attempt)
+        if ret == _NO_MONEY:
+            attempt = _from_units(floor_units(attempt, step) - 1, step)
             continue
         else:
             tg(f"⛔ ENTRY FAIL {symbol} ret={ret} {cmt}")
             return False
 
     if ALLOW_SPLIT_ENTRIES and filled < target:
-        remain = round(target - filled, 10)
-        while remain >= vol_min - 1e-12:
-            piece = min(vol_min, remain)
-            ok, ret, cmt = _send_deal(symbol, side, piece)
+        reqs = _prepare_split_requests(symbol, side, target - filled, vol_min)
+        for req, (ok, ret, cmt) in _submit_all(reqs):
+            piece = req["volume"]
             if not ok:
-                log(f"[WARN] split fail ret={ret} {cmt} (piece={piece}, filled={filled})")
-                if ret == mt5.TRADE_RETCODE_NO_MONEY:
-                    break
-                else:
-                    break
-            filled = round(filled + piece, 10)
-            remain = round(target - filled, 10)
-            log(f"[OK] split {side} {piece} {symbol} (filled={filled}/{target})")
+                log("[WARN] split fail ret=%s %s (piece=%s, filled=%s)", ret, cmt, piece, filled)
+                break
+            filled = round(filled + piece, _step_digits(step))
+            log("[OK] split %s %s %s (filled=%s/%s)", side, piece, symbol, filled, target)
 
     if filled > 0:
+        if filled < target:
+            _mark_incomplete()
         tg(f"✅ ENTRY {side.upper()} {filled} {symbol} (target {target})")
         return True
 
@@ -494,91 +1012,96 @@ def send_market_order(symbol: str, side: str, lot: float) -> bool:
 
 # ============== CLOSE_BY/청산 ==============
 def close_by_opposites_if_any(symbol: str) -> bool:
-    poss = mt5.positions_get(symbol=symbol) or []
-    buys = [p for p in poss if p.type == mt5.POSITION_TYPE_BUY]
-    sells = [p for p in poss if p.type == mt5.POSITION_TYPE_SELL]
-    if not buys or not sells:
+    poss = get_positions(symbol)
+    if len(poss) < 2:
         return True
 
-    info = mt5.symbol_info(symbol)
-    if not info or not info.visible:
-        mt5.symbol_select(symbol, True)
-    info = mt5.symbol_info(symbol)
-
-    step = (info and info.volume_step) or 0.01
+    step, _, _ = get_symbol_steps(symbol)
+    # [ticket, 남은 step 칸 수] — 포지션 객체(namedtuple)는 건드리지 않고 로컬 정수만 차감
+    buys, sells = [], []
+    for p in poss:
+        if p.type == _POS_BUY:
+            buys.append([p.ticket, floor_units(p.volume, step)])
+        elif p.type == _POS_SELL:
+            sells.append([p.ticket, floor_units(p.volume, step)])
+    if not buys or not sells:
+        return True
+    buys.sort(key=lambda x: -x[1])
+    sells.sort(key=lambda x: -x[1])
+    t0 = time.perf_counter_ns()
     ok = True
-    for b in buys:
-        remain = b.volume
-        for s in sells:
-            if remain <= 0:
-                break
-            if s.volume <= 0:
-                continue
-            qty = min(remain, s.volume)
-            qty = math.floor(qty / step) * step
-            if qty <= 0:
-                continue
-            req = {
-                "action": mt5.TRADE_ACTION_CLOSE_BY,
-                "symbol": symbol,
-                "position": b.ticket,
-                "position_by": s.ticket,
-                "volume": qty,
-                "type_filling": mt5.ORDER_FILLING_IOC,
-            }
-            r = mt5.order_send(req)
-            if r and r.retcode == mt5.TRADE_RETCODE_DONE:
-                log(f"[OK] CLOSE_BY b#{b.ticket} vs s#{s.ticket} vol={qty}")
-                remain = round(remain - qty, 10)
-                s.volume = round(s.volume - qty, 10)
-            else:
-                ok = False
-                log(f"[ERR] CLOSE_BY ret={getattr(r,'retcode',None)} {getattr(r,'comment','')}")
+    i = j = 0
+    while i < len(buys) and j < len(sells):
+        b, s = buys[i], sells[j]
+        n = min(b[1], s[1])
+        if n <= 0:
+            # step 미만 잔량은 상계 불가 → 다 쓴 쪽을 넘긴다
+            if b[1] <= 0:
+                i += 1
+            if s[1] <= 0:
+                j += 1
+            continue
+        qty = _from_units(n, step)
+        req = {
+            "action": _CLOSE_BY,
+            "symbol": symbol,
+            "position": b[0],
+            "position_by": s[0],
+            "volume": qty,
+            "type_filling": _IOC,
+        }
+        r = _order_send(req)
+        if r and r.retcode == _DONE:
+            log("[OK] CLOSE_BY b#%s vs s#%s vol=%s", b[0], s[0], qty)
+            b[1] -= n
+            s[1] -= n
+            if b[1] <= 0:
+                i += 1
+            if s[1] <= 0:
+                j += 1
+        else:
+            ok = False
+            log("[ERR] CLOSE_BY ret=%s %s", getattr(r, "retcode", None), getattr(r, "comment", ""))
+            j += 1
+    _H_CLOSE_BY.add(time.perf_counter_ns() - t0)
     return ok
 
 def _close_volume_by_tickets(symbol: str, side_now: str, vol_to_close: float) -> bool:
     if vol_to_close <= 0:
         return True
-    ttype = mt5.POSITION_TYPE_BUY if side_now == "long" else mt5.POSITION_TYPE_SELL
-    poss = [p for p in (mt5.positions_get(symbol=symbol) or []) if p.type == ttype]
+    ttype = _POS_BUY if side_now == "long" else _POS_SELL
+    poss = [p for p in get_positions(symbol) if p.type == ttype]
     if not poss:
         log("[WARN] no positions to close")
         return True
 
-    info = mt5.symbol_info(symbol)
-    if not info or not info.visible:
-        mt5.symbol_select(symbol, True)
-        info = mt5.symbol_info(symbol)
-
-    step = (info and info.volume_step) or 0.01
-    price = (info.bid if side_now == "long" else info.ask)
-    remain = vol_to_close
+    tick = get_tick(symbol)
+    step, _, _ = get_symbol_steps(symbol)
+    price = (tick.bid if side_now == "long" else tick.ask)
+    otype = (_SELL if side_now == "long" else _BUY)
+    tmpl = _req_template(symbol)
+    remain = floor_units(vol_to_close, step)
     ok = True
 
     for p in poss:
         if remain <= 0:
             break
-        qty = min(p.volume, remain)
-        qty = math.floor(qty / step) * step
-        if qty <= 0:
+        n = min(floor_units(p.volume, step), remain)
+        if n <= 0:
             continue
-        req = {
-            "action": mt5.TRADE_ACTION_DEAL,
-            "symbol": symbol,
-            "type": (mt5.ORDER_TYPE_SELL if side_now == "long" else mt5.ORDER_TYPE_BUY),
-            "position": p.ticket,
-            "volume": qty,
-            "price": price,
-            "deviation": 50,
-            "type_filling": mt5.ORDER_FILLING_IOC,
-        }
-        r = mt5.order_send(req)
-        if r and r.retcode == mt5.TRADE_RETCODE_DONE:
-            log(f"[OK] close ticket={p.ticket} {qty} {symbol}")
-            remain = round(remain - qty, 10)
+        qty = _from_units(n, step)
+        req = tmpl.copy()
+        req["type"] = otype
+        req["position"] = p.ticket
+        req["volume"] = qty
+        req["price"] = price
+        r = _order_send(req)
+        if r and r.retcode == _DONE:
+            log("[OK] close ticket=%s %s %s", p.ticket, qty, symbol)
+            remain -= n
         else:
             ok = False
-            log(f"[ERR] close ticket={p.ticket} ret={getattr(r,'retcode',None)} {getattr(r,'comment','')}")
+            log("[ERR] close ticket=%s ret=%s %s", p.ticket, getattr(r, "retcode", None), getattr(r, "comment", ""))
     return ok
 
 def close_partial(symbol: str, side_now: str, lot_close: float) -> bool:
@@ -598,36 +1121,82 @@ def close_all(symbol: str) -> bool:
         tg(f"🧹 CLOSE ALL {symbol}")
     return ok
 
-def close_all_for_candidates(candidates: List[str]) -> bool:
-    anything = False
-    for sym in candidates:
-        if is_blocked_symbol(sym):
-            continue
-        poss = mt5.positions_get(symbol=sym)
-        if not poss:
-            continue
+def close_all_for_candidates(candidates: Tuple[str, ...]) -> bool:
+    """후보 심볼 중 포지션이 있는 것만 전부 청산. 하나라도 실패하면 False."""
+    by_sym = positions_by_symbol()
+    open_syms = [sym for sym in candidates if by_sym.get(sym)]
+    if not open_syms:
+        return True
+
+    ok = True
+    for sym in open_syms:
         try:
             close_by_opposites_if_any(sym)
         except Exception:
-            log("[WARN] CLOSE_BY error:\n" + traceback.format_exc())
+            log("[WARN] CLOSE_BY error:\n%s", traceback.format_exc())
         try:
             s, v = get_position(sym)
             if s != "flat" and v > 0:
-                _ = close_all(sym)
-                anything = True
+                ok = close_all(sym) and ok
         except Exception:
-            log("[WARN] close_all error:\n" + traceback.format_exc())
-    return True if anything or True else True
+            ok = False
+            log("[WARN] close_all error:\n%s", traceback.format_exc())
+    return ok
 
 # ============== 시그널 처리 ==============
-EXIT_ACTIONS = {"close", "exit", "flat", "stop", "sl", "tp", "close_all"}
+EXIT_ACTIONS = frozenset({"close", "exit", "flat", "stop", "sl", "tp", "close_all"})
+
+_SIG_SYMBOL_KEYS = ("symbol", "sym", "ticker", "SYMBOL", "Symbol", "s")
 
-def _read_symbol_from_signal(sig: dict) -> str:
-    for k in ["symbol", "sym", "ticker", "SYMBOL", "Symbol", "s"]:
+def _read_symbol_from_signal(sig: dict, fallback: str = "") -> str:
+    for k in _SIG_SYMBOL_KEYS:
         v = sig.get(k)
         if v:
             return str(v).strip()
-    return ""
+    return fallback
+
+def _lower_str(v) -> str:
+    # 페이로드는 이미 JSON 파싱된 dict 라 대부분 str → str() 변환 없이 바로 처리
+    if isinstance(v, str):
+        return v.strip().lower()
+    return "" if v is None else str(v).strip().lower()
+
+def _to_float(v) -> Optional[float]:
+    # 숫자는 바로, 빈 문자열/None 은 예외 없이 None
+    if v is None:
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    if isinstance(v, str):
+        v = v.strip()
+        if not v:
+            return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+_MP_SET = frozenset({"long", "short", "flat"})
+
+class ParsedSignal(NamedTuple):
+    symbol: str
+    action: str
+    contracts: Optional[float]
+    pos_after: Optional[float]
+    market_position: str
+
+def parse_signal(sig: dict) -> ParsedSignal:
+    """handle_signal 이 쓰는 필드를 dict 한 번 훑어서 정리."""
+    symbol_req = _read_symbol_from_signal(sig, DEFAULT_SYMBOL)
+
+    contracts = None if IGNORE_SIGNAL_CONTRACTS else _to_float(sig.get("contracts"))
+    pos_after = _to_float(sig.get("pos_after"))
+
+    market_position = _lower_str(sig.get("market_position"))
+    if market_position not in _MP_SET:
+        market_position = ""
+
+    return ParsedSignal(symbol_req, _lower_str(sig.get("action")), contracts, pos_after, market_position)
 
 # 포지션 크기 기준 동적 분할 랏 (항상 대략 1/3)
 def dynamic_partial_lot(vol_now: float, step: float) -> float:
@@ -641,28 +1210,60 @@ def dynamic_partial_lot(vol_now: float, step: float) -> float:
         lot = vol_now
     return lot
 
-def handle_signal(sig: dict) -> bool:
-    symbol_req = _read_symbol_from_signal(sig)
-    if not symbol_req and DEFAULT_SYMBOL:
-        symbol_req = DEFAULT_SYMBOL
+# 같은 브로커 심볼에 같은 (pos_after, action) 신호가 짧은 간격으로 또 오면 중복으로 보고 건너뜀
+# 읽기/기록은 항상 그 심볼의 _symbol_lock 안에서 (판정 → 실행 → 기록이 한 덩어리)
+DEDUP_WINDOW_SEC = 3.0
+_LAST_TARGET: Dict[str, Tuple[float, str, float]] = {}  # 브로커 심볼 → (pos_after, action, 처리시각)
 
-    action = str(sig.get("action", "")).strip().lower()
+# 지금 스레드가 처리 중인 신호가 일부만 체결/청산됐는지. 그런 신호는 목표로 기록하지 않는다.
+_EXEC_STATE = threading.local()
 
-    contracts = sig.get("contracts", None)
-    try:
-        contracts = float(contracts) if (contracts is not None and str(contracts).strip() != "") else None
-    except:
-        contracts = None
-    if IGNORE_SIGNAL_CONTRACTS:
-        contracts = None
+def _mark_incomplete():
+    _EXEC_STATE.incomplete = True
 
-    pos_after_raw = sig.get("pos_after", None)
-    try:
-        pos_after = float(pos_after_raw) if pos_after_raw is not None and str(pos_after_raw).strip() != "" else None
-    except:
-        pos_after = None
+# 서버 재전송 등으로 같은 신호(같은 봉 시각 포함)가 다시 오면 실행 없이 처리 완료로 본다.
+# 시각 필드가 없는 신호는 정상적인 연속 분할 신호와 구분이 안 되므로 대상에서 뺀다.
+SEEN_SIGNALS_MAX = 256
+_SEEN_SIGNALS: "collections.OrderedDict[tuple, bool]" = collections.OrderedDict()
+_SEEN_LOCK = threading.Lock()
+
+def _signal_identity(sig: dict, parsed: ParsedSignal) -> Optional[tuple]:
+    ts = sig.get("time") or sig.get("timenow")
+    if not ts:
+        return None
+    return (*parsed, str(ts))
+
+# 별칭("NQ1!", "NAS100", "US100" …)이 달라도 같은 브로커 심볼이면 같은 락.
+# _MT5_ORDER_LOCK 은 order_send 한 번만 감싸므로, 두 워커가 같은 포지션을
+# 동시에 플랫으로 읽고 둘 다 진입하는 일을 여기서 막는다.
+_SYMBOL_LOCKS: Dict[str, threading.Lock] = {}
+
+def _symbol_lock(mt5_symbol: str) -> threading.Lock:
+    lock = _SYMBOL_LOCKS.get(mt5_symbol)
+    if lock is None:
+        lock = _SYMBOL_LOCKS.setdefault(mt5_symbol, threading.Lock())
+    return lock
+
+def handle_signal(sig: dict) -> bool:
+    parsed = parse_signal(sig)
+    ident = _signal_identity(sig, parsed)
+    if ident is not None:
+        with _SEEN_LOCK:
+            seen = ident in _SEEN_SIGNALS
+        if seen:
+            log("[SKIP] duplicate signal %s action=%s time=%s", parsed.symbol, parsed.action, ident[-1])
+            return True
+
+    ok = _execute_signal(parsed)
+    if ok and ident is not None:
+        with _SEEN_LOCK:
+            _SEEN_SIGNALS[ident] = True
+            if len(_SEEN_SIGNALS) > SEEN_SIGNALS_MAX:
+                _SEEN_SIGNALS.popitem(last=False)
+    return ok
 
-    market_position = str(sig.get("market_position", "")).strip().lower()
+def _execute_signal(parsed: ParsedSignal) -> bool:
+    symbol_req, action, contracts, pos_after, market_position = parsed
 
     symbol_key = (symbol_req or "").strip().upper()
     prev_pos = LAST_TV_POS.get(symbol_key) if symbol_key else None
@@ -680,31 +1281,49 @@ def handle_signal(sig: dict) -> bool:
     if symbol_key and pos_after is not None:
         LAST_TV_POS[symbol_key] = pos_after
 
-    cand_syms = build_candidate_symbols(symbol_req) if symbol_req else []
+    cand_syms = build_candidate_symbols(symbol_req) if symbol_req else ()
     open_sym = detect_open_symbol_from_candidates(cand_syms) if cand_syms else detect_any_open_from_alias_pool()
     if open_sym:
         mt5_symbol = open_sym
-        info = mt5.symbol_info(mt5_symbol)
-        step = (info and info.volume_step) or 0.01
-        vol_min = (info and info.volume_min) or step
+        if symbol_key:
+            _RESOLVED[symbol_key] = open_sym
         base_hint = symbol_req or mt5_symbol
         base_lot_conf = get_fixed_lot_for_symbol(base_hint)
-        desired = max(vol_min, base_lot_conf)
-        lot_base = ceil_to_step(desired, step)
-        log(f"[lot-base] resolved={mt5_symbol} step={step} min={vol_min} BASE={base_lot_conf} -> {lot_base}")
+        lot_base = normalize_volume(mt5_symbol, base_lot_conf)
     else:
         base_req = symbol_req if symbol_req else (DEFAULT_SYMBOL or "NAS100")
         base_lot_conf = get_fixed_lot_for_symbol(base_req)
         mt5_symbol, lot_base = pick_best_symbol_and_lot(base_req, base_lot_conf)
         if not mt5_symbol:
-            log(f"[ERR] tradable symbol not found for req={symbol_req}")
+            log("[ERR] tradable symbol not found for req=%s", symbol_req)
             return False
 
+    ctx = symbol_ctx(mt5_symbol)
+    if open_sym:
+        log_debug("[lot-base] resolved=%s step=%s min=%s BASE=%s -> %s", mt5_symbol, ctx.step, ctx.vol_min, base_lot_conf, lot_base)
+    # 포지션 조회 → 판단 → 주문은 브로커 심볼 단위로 한 번에 하나씩
+    with _symbol_lock(mt5_symbol):
+        if pos_after is not None:
+            last = _LAST_TARGET.get(mt5_symbol)
+            if (last and last[0] == pos_after and last[1] == action
+                    and time.monotonic() - last[2] < DEDUP_WINDOW_SEC):
+                log("[SKIP] dedup %s action=%s pos_after=%s (same target within %ss)", mt5_symbol, action, pos_after, DEDUP_WINDOW_SEC)
+                return True
+        _EXEC_STATE.incomplete = False
+        ok = _act_on_symbol(parsed, ctx, cand_syms, lot_base, position_change)
+        if ok and not _EXEC_STATE.incomplete and pos_after is not None:
+            _LAST_TARGET[mt5_symbol] = (pos_after, action, time.monotonic())
+        return ok
+
+def _act_on_symbol(parsed: ParsedSignal, ctx: SymCtx, cand_syms: Tuple[str, ...], lot_base: float, position_change: str) -> bool:
+    symbol_req, action, contracts, pos_after, market_position = parsed
+    mt5_symbol = ctx.name
     side_now, vol_now = get_position(mt5_symbol)
     log(
-        f"[state] req={symbol_req} resolved={mt5_symbol}: now={side_now} {vol_now}lot, "
-        f"action={action}, market_pos={market_position}, pos_after={pos_after}, "
-        f"contracts={contracts}, STRICT={STRICT_FIXED_MODE}, TV_change={position_change}"
+        "[state] req=%s resolved=%s: now=%s %slot, action=%s, market_pos=%s, pos_after=%s, "
+        "contracts=%s, STRICT=%s, TV_change=%s",
+        symbol_req, mt5_symbol, side_now, vol_now, action, market_position, pos_after,
+        contracts, STRICT_FIXED_MODE, position_change,
     )
 
     # === 보호: 계좌는 플랫인데 TV는 반대 포지션 청산 방향을 지시하는 경우 ===
@@ -717,10 +1336,11 @@ def handle_signal(sig: dict) -> bool:
             return True
 
     # === 전량 종료 의도 ===
-    exit_intent = (market_position == "flat") or (action in EXIT_ACTIONS) or (pos_after == 0)
+    exit_intent = action in EXIT_ACTIONS or market_position == "flat" or pos_after == 0
     if exit_intent:
         targets = cand_syms if cand_syms else build_candidate_symbols(mt5_symbol)
-        close_all_for_candidates(targets)
+        if not close_all_for_candidates(targets):
+            _mark_incomplete()
         s, v = get_position(mt5_symbol)
         if s != "flat" and v > 0:
             close_by_opposites_if_any(mt5_symbol)
@@ -728,127 +1348,324 @@ def handle_signal(sig: dict) -> bool:
         log("[SKIP] exit-intent handled (flat/closed)")
         return True
 
-    # === STRICT_FIXED_MODE: 고정 랏/분할 랏만 사용 ===
-    if STRICT_FIXED_MODE:
-        info = mt5.symbol_info(mt5_symbol)
-        step = (info and info.volume_step) or 0.01
-        partial_lot = PARTIAL_LOT if (PARTIAL_LOT and PARTIAL_LOT > 0) else (FIXED_ENTRY_LOT if FIXED_ENTRY_LOT > 0 else step)
-
-        if side_now == "flat":
-            if position_change == "decrease":
-                log("[SKIP] flat + decreasing TV position (STRICT) -> treat as exit-only; no new entry")
-                return True
+    # === 계좌는 플랫인데 TV 포지션은 줄어드는 중 → 종료로 보고 신규 진입 안 함 ===
+    if side_now == "flat" and position_change == "decrease":
+        if STRICT_FIXED_MODE:
+            log("[SKIP] flat + decreasing TV position (STRICT) -> treat as exit-only; no new entry")
+        else:
+            log("[SKIP] flat + decreasing TV position -> treat as exit-only; no new entry")
+        return True
 
-            if action not in ("buy", "sell"):
+    fn = _DISPATCH.get((STRICT_FIXED_MODE, side_now, action))
+    if fn is None:
+        if STRICT_FIXED_MODE:
+            if side_now == "flat":
                 log("[SKIP] unknown action for flat state (STRICT)")
-                return True
-            desired_side = "buy" if action == "buy" else "sell"
-            return send_market_order(mt5_symbol, desired_side, lot_base)
-
-        if side_now == "long":
-            if action == "sell":
-                lot_close = min(vol_now, max(step, partial_lot))
-                return close_partial(mt5_symbol, side_now, lot_close)
-            elif action == "buy":
-                return send_market_order(mt5_symbol, "buy", lot_base)
             else:
-                log("[SKIP] unsupported action (STRICT, long)")
-                return True
-
-        if side_now == "short":
-            if action == "buy":
-                lot_close = min(vol_now, max(step, partial_lot))
-                return close_partial(mt5_symbol, side_now, lot_close)
-            elif action == "sell":
-                return send_market_order(mt5_symbol, "sell", lot_base)
-            else:
-                log("[SKIP] unsupported action (STRICT, short)")
-                return True
-
+                log("[SKIP] unsupported action (STRICT, %s)", side_now)
+        elif side_now == "flat":
+            log("[SKIP] unknown action for flat state]")
+        else:
+            log("[SKIP] same-direction or unsupported signal; no action taken")
         return True
+    return fn(ctx, side_now, vol_now, action, lot_base)
 
-    # === STRICT 모드가 아닐 때 ===
-    if side_now == "flat":
-        if position_change == "decrease":
-            log("[SKIP] flat + decreasing TV position -> treat as exit-only; no new entry")
-            return True
-
-        if action not in ("buy", "sell"):
-            log("[SKIP] unknown action for flat state]")
-            return True
-        desired_side = "buy" if action == "buy" else "sell"
-        return send_market_order(mt5_symbol, desired_side, lot_base)
-
-    # ▼ 여기부터 일반 모드 분할 종료 로직(모든 종목 공통) ▼
-    if side_now == "long" and action == "sell":
-        info = mt5.symbol_info(mt5_symbol)
-        step = (info and info.volume_step) or 0.01
-        lot_close = dynamic_partial_lot(vol_now, step)
-        if lot_close <= 0:
-            log("[INFO] calc close_qty <= 0 -> skip")
-            return True
-        return close_partial(mt5_symbol, side_now, lot_close)
-
-    if side_now == "short" and action == "buy":
-        info = mt5.symbol_info(mt5_symbol)
-        step = (info and info.volume_step) or 0.01
-        lot_close = dynamic_partial_lot(vol_now, step)
-        if lot_close <= 0:
-            log("[INFO] calc close_qty <= 0 -> skip")
-            return True
-        return close_partial(mt5_symbol, side_now, lot_close)
+# ▼ (보유상태, 액션) 별 처리 — (ctx, side_now, vol_now, action, lot_base) ▼
+def _do_entry(ctx: SymCtx, side_now: str, vol_now: float, action: str, lot_base: float) -> bool:
+    return send_market_order(ctx.name, action, lot_base)
 
-    log("[SKIP] same-direction or unsupported signal; no action taken")
-    return True
+def _do_partial_close(ctx: SymCtx, side_now: str, vol_now: float, action: str, lot_base: float) -> bool:
+    # 분할 종료 로직(모든 종목 공통)
+    lot_close = dynamic_partial_lot(vol_now, ctx.step)
+    if lot_close <= 0:
+        log("[INFO] calc close_qty <= 0 -> skip")
+        return True
+    return close_partial(ctx.name, side_now, lot_close)
+
+def _do_fixed_partial_close(ctx: SymCtx, side_now: str, vol_now: float, action: str, lot_base: float) -> bool:
+    # STRICT_FIXED_MODE: 고정 분할 랏(PARTIAL_LOT → FIXED_ENTRY_LOT → step)만큼만 종료
+    partial_lot = PARTIAL_LOT if (PARTIAL_LOT and PARTIAL_LOT > 0) else (FIXED_ENTRY_LOT if FIXED_ENTRY_LOT > 0 else ctx.step)
+    lot_close = min(vol_now, max(ctx.step, partial_lot))
+    return close_partial(ctx.name, side_now, lot_close)
+
+# (STRICT_FIXED_MODE, 보유상태, 액션) → 처리 함수. 없는 조합은 SKIP.
+# STRICT 모드는 같은 방향 신호면 고정 랏으로 추가 진입한다.
+_DISPATCH = {
+    (False, "flat", "buy"): _do_entry,
+    (False, "flat", "sell"): _do_entry,
+    (False, "long", "sell"): _do_partial_close,
+    (False, "short", "buy"): _do_partial_close,
+    (True, "flat", "buy"): _do_entry,
+    (True, "flat", "sell"): _do_entry,
+    (True, "long", "buy"): _do_entry,
+    (True, "short", "sell"): _do_entry,
+    (True, "long", "sell"): _do_fixed_partial_close,
+    (True, "short", "buy"): _do_fixed_partial_close,
+}
 
 # ============== 폴링 루프 ==============
-def poll_loop():
-    log(f"env FIXED_ENTRY_LOT={FIXED_ENTRY_LOT} REQUIRE_MARGIN_CHECK={REQUIRE_MARGIN_CHECK} ALLOW_SPLIT_ENTRIES={ALLOW_SPLIT_ENTRIES}")
-    log(f"env STRICT_FIXED_MODE={STRICT_FIXED_MODE} PARTIAL_LOT={PARTIAL_LOT} DEFAULT_SYMBOL='{DEFAULT_SYMBOL}' IGNORE_SIGNAL_CONTRACTS={IGNORE_SIGNAL_CONTRACTS}")
-    log(f"Agent start. server={SERVER_URL}")
-    tg("🤖 MT5 Agent started")
-
-    import random
+def _handle_group(group: List[Tuple[Any, dict]]):
+    # 그룹이 끝나는 대로 ack 대기열에 넣는다 (중간에 종료돼도 끝난 그룹의 ack 는 남도록)
+    ack_ids, failed_ids = [], []
+    for item_id, sig in group:
+        ok = False
+        try:
+            ok = handle_signal(sig)
+        except Exception as e:
+            log("[ERR] handle_signal: %s\n%s", e, traceback.format_exc())
+            ok = False
+        if item_id is not None:
+            (ack_ids if ok else failed_ids).append(item_id)
+    if ack_ids or failed_ids:
+        _ACK_Q.put((ack_ids, failed_ids))
+
+# /pull 은 별도 스레드가 미리 받아 두고(최대 2배치), 메인 루프는 처리만 한다.
+# ack 는 _ACK_Q 에 모았다가 ACK_FLUSH_SEC 마다(또는 MAX_BATCH 개 모이면) 한 번에 전송.
+ACK_FLUSH_SEC = 0.1
+_TASK_Q: queue.Queue = queue.Queue(maxsize=2)
+_ACK_Q: queue.Queue = queue.Queue()
+# 종료 신호: set 되면 pull/ack/워치독 스레드가 대기 중이던 곳에서 바로 빠져나온다
+_STOP = threading.Event()
+# 가져왔지만 실행 못 한 신호 id — 종료 시 /ack 의 requeue_ids 로 서버 큐에 되돌린다
+_REQUEUE: List[Any] = []
+
+def _item_ids(items: List[dict]) -> List[Any]:
+    return [it.get("id") for it in items if it.get("id") is not None]
+
+def _pull_producer():
     tick = 0
     consec_fail = 0
-
-    while True:
+    lp_fail = 0
+    lp_off_until = 0.0
+    interval = POLL_INTERVAL_SEC
+    while not _STOP.is_set():
         tick += 1
         if tick % 100 == 0:
             _ = get_health()
 
         try:
-            res = post_json("/pull", {"agent_key": AGENT_KEY, "max_batch": MAX_BATCH})
-            items = res.get("items") or []
-            if not items:
-                time.sleep(POLL_INTERVAL_SEC + random.random() * 0.7)
-                consec_fail = 0
+            # 터미널이 끊겨 있으면 가져와 봐야 실패만 하므로 /pull 보류 (재접속은 워치독 담당)
+            if not mt5_connected():
+                _STOP.wait(2.0)
                 continue
-
-            ack_ids = []
-            for it in items:
-                item_id = it.get("id")
-                sig = it.get("signal") or it.get("payload") or it
-                ok = False
-                try:
-                    ok = handle_signal(sig)
-                except Exception as e:
-                    log(f"[ERR] handle_signal: {e}\n" + traceback.format_exc())
-                    ok = False
-                if ok and item_id is not None:
-                    ack_ids.append(item_id)
-
-            if ack_ids:
-                _ = post_json("/ack", {"agent_key": AGENT_KEY, "ids": ack_ids})
+            t0 = time.monotonic()
+            wait_ms = PULL_WAIT_MS if t0 >= lp_off_until else 0
+            # 아직 안 보낸 ack 가 있으면 /pull 에 실어 보낸다 (왕복 1회 절약)
+            ack_ids, failed_ids = _drain_acks()
+            t_ns = time.perf_counter_ns()
+            res = post_json(
+                "/pull",
+                {"agent_key": AGENT_KEY, "max_batch": MAX_BATCH, "wait_ms": wait_ms,
+                 "ack_ids": ack_ids, "failed_ids": failed_ids},
+                timeout=wait_ms / 1000.0 + 10.0,
+            )
+            if not wait_ms:
+                _H_PULL.add(time.perf_counter_ns() - t_ns)
             consec_fail = 0
+            # 실패했거나, ack_ids 를 모르는 구버전 서버(acked 없음)면 /ack 경로로 다시 보낸다
+            if (ack_ids or failed_ids) and (not res.get("ok") or "acked" not in res):
+                _ACK_Q.put((ack_ids, failed_ids))
+            if not res.get("ok"):
+                # 타임아웃/연결 오류 (post_json 이 {} 반환)
+                if wait_ms:
+                    lp_fail += 1
+                    if lp_fail >= 3:
+                        lp_off_until = time.monotonic() + LONG_POLL_RETRY_SEC
+                        lp_fail = 0
+                        log("[WARN] long-poll failing → short-poll for %ss", LONG_POLL_RETRY_SEC)
+            elif wait_ms:
+                lp_fail = 0
+            items = res.get("items") or []
+            if items:
+                interval = POLL_INTERVAL_SEC
+                while not _STOP.is_set():
+                    try:
+                        _TASK_Q.put(items, timeout=1.0)
+                        break
+                    except queue.Full:
+                        pass
+                else:
+                    # 종료 중에 받은 배치는 실행하지 않고 돌려준다
+                    _REQUEUE.extend(_item_ids(items))
+                continue
+            # 숏폴이거나 에러로 즉시 돌아온 경우에만 쉬었다가 다시
+            if time.monotonic() - t0 < interval:
+                _STOP.wait(interval + random.random() * 0.7)
+                interval = min(interval * 1.5, max(POLL_INTERVAL_SEC, POLL_INTERVAL_MAX_SEC))
         except Exception as e:
-            log(f"[WARN] poll_loop exception: {e}")
+            log("[WARN] pull exception: %s", e)
             consec_fail += 1
-            backoff = min(30.0, (1.5 ** consec_fail))
-            time.sleep(backoff)
+            _STOP.wait(min(30.0, (1.5 ** consec_fail)))
+
+def _drain_acks() -> Tuple[List[Any], List[Any]]:
+    ack_ids, failed_ids = [], []
+    while True:
+        try:
+            done, failed = _ACK_Q.get_nowait()
+        except queue.Empty:
+            return ack_ids, failed_ids
+        ack_ids += done
+        failed_ids += failed
+
+def flush_acks_now():
+    """종료 시 남은 ack 와 되돌릴 신호(requeue_ids)를 /ack 로 바로 보낸다."""
+    ack_ids, failed_ids = _drain_acks()
+    requeue_ids = list(_REQUEUE)
+    del _REQUEUE[:]
+    if ack_ids or failed_ids or requeue_ids:
+        post_json("/ack", {"agent_key": AGENT_KEY, "ids": ack_ids, "failed_ids": failed_ids,
+                           "requeue_ids": requeue_ids}, timeout=5.0)
+
+def _ack_flusher():
+    # /pull 이 롱폴로 잡혀 있는 동안 쌓인 ack 는 여기서 따로 보낸다
+    while not _STOP.is_set():
+        try:
+            done, failed = _ACK_Q.get(timeout=1.0)
+        except queue.Empty:
             continue
+        ack_ids, failed_ids = list(done), list(failed)
+        deadline = time.monotonic() + ACK_FLUSH_SEC
+        while len(ack_ids) + len(failed_ids) < MAX_BATCH:
+            remain = deadline - time.monotonic()
+            if remain <= 0:
+                break
+            try:
+                done, failed = _ACK_Q.get(timeout=remain)
+            except queue.Empty:
+                break
+            ack_ids += done
+            failed_ids += failed
+        # 성공/실패를 한 번의 /ack 로 보고. 실패하면 다시 대기열로 (다음 /pull 에 실릴 수도 있음)
+        t_ns = time.perf_counter_ns()
+        res = post_json("/ack", {"agent_key": AGENT_KEY, "ids": ack_ids, "failed_ids": failed_ids})
+        _H_ACK.add(time.perf_counter_ns() - t_ns)
+        if not res.get("ok"):
+            _ACK_Q.put((ack_ids, failed_ids))
+            _STOP.wait(1.0)
+
+# ============== MT5 연결 감시 ==============
+def reset_mt5_caches():
+    """재접속 후에는 심볼/포지션/마진 캐시를 전부 다시 받는다."""
+    global _SYMBOLS, _POS_SNAPSHOT
+    _SYMBOL_DYN.clear()
+    _SYMBOL_STATIC.clear()
+    _TICK.clear()
+    _SELECTED.clear()
+    _MARGIN_CACHE.clear()
+    invalidate_account_info()
+    _POS_CACHE.clear()
+    _POS_SNAPSHOT = (0.0, {})
+    _SYMBOLS = (0.0, (), {})
+    _rebuild_name_blob(())
+    _build_candidate_symbols.cache_clear()
+    alias_matches.cache_clear()
+
+def mt5_connected() -> bool:
+    ti = mt5.terminal_info()
+    return ti is not None and bool(ti.connected)
+
+def _mt5_watchdog():
+    # 끊김 → 복구로 상태가 바뀔 때만 캐시를 비우고 알린다.
+    # 터미널은 떠 있는데 브로커 연결만 끊긴 동안에는 initialize() 가 성공해도 connected=False 이므로
+    # 재시도 간격을 늘려 가며 주문 락을 덜 잡는다.
+    was_connected = True
+    delay = MT5_WATCHDOG_SEC
+    while not _STOP.wait(delay):
+        try:
+            if not mt5_connected():
+                if was_connected:
+                    log("[WARN] MT5 terminal disconnected → reconnect")
+                    was_connected = False
+                # 주문 전송 중에 끊고 다시 붙지 않도록 주문 락을 잡고 재접속
+                with _MT5_ORDER_LOCK:
+                    mt5.shutdown()
+                    ensure_mt5_initialized()
+                if not mt5_connected():
+                    delay = min(delay * 2, max(MT5_WATCHDOG_SEC, MT5_WATCHDOG_MAX_SEC))
+                    continue
+            delay = MT5_WATCHDOG_SEC
+            if not was_connected:
+                was_connected = True
+                with _MT5_ORDER_LOCK:
+                    reset_mt5_caches()
+                log("MT5 connection restored")
+                tg("🔌 MT5 reconnected")
+        except Exception:
+            log("[ERR] MT5 watchdog exception:\n%s", traceback.format_exc())
+
+def _group_key(symbol_req: str) -> str:
+    """같은 브로커 심볼로 갈 신호를 한 그룹으로: 확정된 심볼 → (없으면) 후보 중 대표 이름."""
+    key = symbol_req.strip().upper()
+    resolved = _RESOLVED.get(key)
+    if resolved:
+        return resolved
+    cands = build_candidate_symbols(key)
+    # 별칭끼리는 후보 묶음이 같으니 순서와 무관한 min 으로 대표를 고른다
+    # (묶음이 조금 달라 갈라져도 실행은 _symbol_lock 으로 직렬화됨)
+    return min(cands) if cands else key
+
+def _process_items(items: List[dict]):
+    futs: Dict[Any, List[Tuple[Any, dict]]] = {}
+    try:
+        # 브로커 심볼별로 묶어 그룹끼리는 병렬, 그룹 안에서는 도착 순서대로 처리
+        groups: Dict[str, List[Tuple[Any, dict]]] = {}
+        for it in items:
+            sig = it.get("signal") or it.get("payload") or it
+            key = _group_key(_read_symbol_from_signal(sig, DEFAULT_SYMBOL))
+            groups.setdefault(key, []).append((it.get("id"), sig))
+
+        prefetch_positions()
+        futs = {EXEC.submit(_handle_group, g): g for g in groups.values()}
+        for fut in as_completed(futs):
+            fut.result()
+    except Exception as e:
+        log("[WARN] poll_loop exception: %s", e)
+    except BaseException:
+        # Ctrl+C 등으로 중단: 아직 시작 안 한 그룹은 취소하고 서버 큐로 되돌린다
+        if not futs:
+            _REQUEUE.extend(_item_ids(items))
+        for fut, g in futs.items():
+            if fut.cancel():
+                _REQUEUE.extend(item_id for item_id, _ in g if item_id is not None)
+        raise
+
+def poll_loop():
+    log("env FIXED_ENTRY_LOT=%s REQUIRE_MARGIN_CHECK=%s ALLOW_SPLIT_ENTRIES=%s", FIXED_ENTRY_LOT, REQUIRE_MARGIN_CHECK, ALLOW_SPLIT_ENTRIES)
+    log("env STRICT_FIXED_MODE=%s PARTIAL_LOT=%s DEFAULT_SYMBOL='%s' IGNORE_SIGNAL_CONTRACTS=%s", STRICT_FIXED_MODE, PARTIAL_LOT, DEFAULT_SYMBOL, IGNORE_SIGNAL_CONTRACTS)
+    log("env SIGNAL_WORKERS=%s PULL_WAIT_MS=%s LOG_LEVEL=%s", SIGNAL_WORKERS, PULL_WAIT_MS, LOG_LEVEL)
+    log("Agent start. server=%s", SERVER_URL)
+    tg("🤖 MT5 Agent started")
+
+    puller = threading.Thread(target=_pull_producer, name="pull", daemon=True)
+    acker = threading.Thread(target=_ack_flusher, name="ack", daemon=True)
+    puller.start()
+    acker.start()
+    threading.Thread(target=_mt5_watchdog, name="mt5-watchdog", daemon=True).start()
 
-        time.sleep(POLL_INTERVAL_SEC)
+    try:
+        while True:
+            try:
+                # timeout 을 둬야 Windows 에서도 Ctrl+C 가 get() 대기 중에 들어온다
+                items = _TASK_Q.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            _process_items(items)
+    except KeyboardInterrupt:
+        log("Agent stopping (KeyboardInterrupt)")
+    finally:
+        # 스레드를 멈추고, 진행 중인 신호 처리가 끝나길 기다린 뒤 남은 ack 를 보낸다
+        _STOP.set()
+        EXEC.shutdown(wait=True)
+        # 롱폴 중인 pull 은 기다리지 않는다 (끊기면 서버가 예약하지 않음)
+        puller.join(timeout=2.0)
+        acker.join(timeout=2.0)
+        # 미리 받아 두고 아직 못 돌린 배치는 서버로 되돌린다
+        while True:
+            try:
+                _REQUEUE.extend(_item_ids(_TASK_Q.get_nowait()))
+            except queue.Empty:
+                break
+        flush_acks_now()
 
 # ============== main ==============
 def main():
@@ -857,7 +1674,7 @@ def main():
         return
     if not ensure_mt5_initialized():
         return
-    log(f"server health: {json.dumps(get_health())}")
+    log("server health: %s", get_health())
     poll_loop()
 
 if __name__ == "__main__":
@@ -1,20 +1,45 @@
 # /server/main.py
 import os
+import asyncio
 import sqlite3
 import json
 import time
 from typing import Optional, List, Dict, Any
 
 from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
+# orjson 이 있으면 응답/페이로드 직렬화를 C 구현으로 (없으면 표준 json)
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as _DefaultResponse
+except ImportError:
+    orjson = None
+    _DefaultResponse = JSONResponse
+
 # ===================== 환경변수 =====================
 DB_PATH    = os.environ.get("DB_PATH", "/tmp/signals.db")
 AUTH_TOKEN = os.environ.get("AUTH_TOKEN")     # TradingView -> Render 인증(Bearer), 선택
 AGENT_KEY  = os.environ.get("AGENT_KEY")      # Agent(Windows) 인증 필수 토큰
+LONG_POLL_MAX_MS = int(os.environ.get("LONG_POLL_MAX_MS", "25000"))  # /pull 대기 상한
+# ack 없이 RESERVE_TIMEOUT_SEC 이 지난 예약을 다시 queued 로 (기본 0 = 끔).
+# 에이전트가 실행 후 ack 전에 죽었으면 재실행되므로, 생성 후 REQUEUE_MAX_AGE_SEC 이내 신호만.
+RESERVE_TIMEOUT_SEC = float(os.environ.get("RESERVE_TIMEOUT_SEC", "0"))
+REQUEUE_MAX_AGE_SEC = float(os.environ.get("REQUEUE_MAX_AGE_SEC", "60"))
 # ===================================================
 
-app = FastAPI(title="TV→Render→MT5 Hub")
+app = FastAPI(title="TV→Render→MT5 Hub", default_response_class=_DefaultResponse)
+
+def _dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
+def _loads(text: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
 
 # ----------------- DB 유틸 -----------------
 def _db() -> sqlite3.Connection:
@@ -31,10 +56,15 @@ def init_db() -> None:
             id         INTEGER PRIMARY KEY AUTOINCREMENT,
             created_at REAL    NOT NULL,
             payload    TEXT    NOT NULL,
-            status     TEXT    NOT NULL DEFAULT 'queued'
+            status     TEXT    NOT NULL DEFAULT 'queued',
+            reserved_at REAL
         )
         """
     )
+    # 예전 DB 에는 reserved_at 컬럼이 없으므로 추가
+    cols = {r["name"] for r in cur.execute("PRAGMA table_info(signals)")}
+    if "reserved_at" not in cols:
+        cur.execute("ALTER TABLE signals ADD COLUMN reserved_at REAL")
     conn.commit()
     conn.close()
 
@@ -45,7 +75,7 @@ def insert_signal(payload: Dict[str, Any]) -> int:
     cur = conn.cursor()
     cur.execute(
         "INSERT INTO signals (created_at, payload, status) VALUES (?, ?, 'queued')",
-        (time.time(), json.dumps(payload, ensure_ascii=False)),
+        (time.time(), _dumps(payload)),
     )
     conn.commit()
     cur.execute("SELECT last_insert_rowid()")
@@ -56,6 +86,14 @@ def insert_signal(payload: Dict[str, Any]) -> int:
 def pull_signals(limit: int = 10) -> List[Dict[str, Any]]:
     conn = _db()
     cur = conn.cursor()
+    now = time.time()
+    if RESERVE_TIMEOUT_SEC > 0:
+        # 가져간 뒤 ack 가 끝내 안 온 예약(응답 유실 등)을 다시 내보낸다. 늦게 실행돼도 될 만큼 새 신호만.
+        # (reserved_at 이 없는 마이그레이션 이전 예약은 건드리지 않음)
+        cur.execute(
+            "UPDATE signals SET status='queued' WHERE status='reserved' AND reserved_at < ? AND created_at >= ?",
+            (now - RESERVE_TIMEOUT_SEC, now - REQUEUE_MAX_AGE_SEC),
+        )
     cur.execute(
         "SELECT id, payload FROM signals WHERE status='queued' ORDER BY id ASC LIMIT ?",
         (limit,),
@@ -64,10 +102,10 @@ def pull_signals(limit: int = 10) -> List[Dict[str, Any]]:
     ids = [int(r["id"]) for r in rows]
     if ids:
         qmarks = ",".join(["?"] * len(ids))
-        cur.execute(f"UPDATE signals SET status='reserved' WHERE id IN ({qmarks})", ids)
-        conn.commit()
+        cur.execute(f"UPDATE signals SET status='reserved', reserved_at=? WHERE id IN ({qmarks})", [now, *ids])
+    conn.commit()
     conn.close()
-    return [{"id": int(r["id"]), "payload": json.loads(r["payload"])} for r in rows]
+    return [{"id": int(r["id"]), "payload": _loads(r["payload"])} for r in rows]
 
 def ack_signals(ids: List[int], status: str = "done") -> None:
     if not ids:
@@ -79,6 +117,17 @@ def ack_signals(ids: List[int], status: str = "done") -> None:
     conn.commit()
     conn.close()
 
+def requeue_signals(ids: List[int]) -> None:
+    """에이전트가 실행하지 않고 돌려준 건만 다시 queued (이미 done/failed 인 건은 그대로)."""
+    if not ids:
+        return
+    conn = _db()
+    cur = conn.cursor()
+    qmarks = ",".join(["?"] * len(ids))
+    cur.execute(f"UPDATE signals SET status='queued' WHERE status='reserved' AND id IN ({qmarks})", ids)
+    conn.commit()
+    conn.close()
+
 def count_by_status() -> Dict[str, int]:
     conn = _db()
     cur = conn.cursor()
@@ -87,15 +136,48 @@ def count_by_status() -> Dict[str, int]:
     conn.close()
     return {r["status"]: r["c"] for r in rows}
 
+# ----------------- 롱폴 대기 -----------------
+# webhook 이 새 신호를 넣으면 set → /pull 에서 대기 중인 에이전트를 깨운다.
+# (uvicorn 이벤트 루프 안에서 만들어야 하므로 첫 사용 시 생성)
+_new_signal: Optional[asyncio.Event] = None
+
+def _signal_event() -> asyncio.Event:
+    global _new_signal
+    if _new_signal is None:
+        _new_signal = asyncio.Event()
+    return _new_signal
+
+async def wait_for_signals(limit: int, wait_sec: float, request: Optional[Request] = None) -> List[Dict[str, Any]]:
+    ev = _signal_event()
+    deadline = time.monotonic() + wait_sec
+    while True:
+        ev.clear()
+        # 대기 중에 에이전트가 끊겼으면(타임아웃/종료) 예약하지 않는다 → 신호는 queued 로 남음
+        if request is not None and await request.is_disconnected():
+            return []
+        items = pull_signals(limit)
+        remain = deadline - time.monotonic()
+        if items or remain <= 0:
+            return items
+        try:
+            await asyncio.wait_for(ev.wait(), timeout=remain)
+        except asyncio.TimeoutError:
+            pass
+
 # ----------------- 스키마 -----------------
 class PullReq(BaseModel):
     agent_key: str
     max_batch: int = 10
+    wait_ms: int = 0       # >0 이면 신호가 올 때까지 최대 wait_ms 동안 응답 보류(롱폴)
+    ack_ids: List[int] = []      # 직전 처리 결과를 /pull 에 실어 보고 (별도 /ack 생략)
+    failed_ids: List[int] = []
 
 class AckReq(BaseModel):
     agent_key: str
     ids: List[int]
     status: str = "done"   # or "failed"
+    failed_ids: List[int] = []   # 같은 요청에서 실패 건도 함께 보고 (status='failed')
+    requeue_ids: List[int] = []  # 가져갔지만 처리 못 한 건 (에이전트 종료 시) → 다시 queued
 
 # ----------------- 라우트 -----------------
 @app.get("/health")
@@ -127,25 +209,39 @@ async def webhook(request: Request, authorization: Optional[str] = Header(None))
         data = {"raw": await request.body()}
 
     rid = insert_signal(data)
+    _signal_event().set()
     return {"ok": True, "id": rid}
 
 @app.post("/pull")
-async def pull(req: PullReq):
+async def pull(req: PullReq, request: Request):
     """
     Windows 에이전트가 작업을 가져가는 엔드포인트.
+    - wait_ms 를 주면 큐가 비어 있을 때 신호가 들어오거나
+      wait_ms(최대 LONG_POLL_MAX_MS)가 지날 때까지 응답을 보류(롱폴).
+      그 사이 연결이 끊기면 아무것도 예약하지 않고 끝낸다.
+    - ack_ids / failed_ids 를 같이 보내면 가져가기 전에 먼저 완료 처리 (acked 로 건수 회신).
     """
     if not AGENT_KEY or req.agent_key != AGENT_KEY:
         raise HTTPException(401, "Unauthorized agent")
-    items = pull_signals(max(1, min(req.max_batch, 100)))
-    return {"ok": True, "items": items}
+    ack_signals(req.ack_ids, "done")
+    ack_signals(req.failed_ids, "failed")
+    limit = max(1, min(req.max_batch, 100))
+    wait_ms = max(0, min(req.wait_ms, LONG_POLL_MAX_MS))
+    items = await wait_for_signals(limit, wait_ms / 1000.0, request)
+    # acked: 같이 받은 ack 건수 (에이전트는 이 키가 없으면 구버전 서버로 보고 /ack 로 다시 보냄)
+    return {"ok": True, "items": items, "acked": len(req.ack_ids) + len(req.failed_ids)}
 
 @app.post("/ack")
 async def ack(req: AckReq):
     """
     Windows 에이전트가 처리 결과를 보고하는 엔드포인트.
     status: "done" 또는 "failed"
+    failed_ids: 한 번의 호출로 실패 건까지 같이 닫을 때 사용
+    requeue_ids: 실행하지 않고 돌려주는 건 (다시 queued 로)
     """
     if not AGENT_KEY or req.agent_key != AGENT_KEY:
         raise HTTPException(401, "Unauthorized agent")
     ack_signals(req.ids, req.status)
-    return {"ok": True, "count": len(req.ids)}
+    ack_signals(req.failed_ids, "failed")
+    requeue_signals(req.requeue_ids)
+    return {"ok": True, "count": len(req.ids) + len(req.failed_ids) + len(req.requeue_ids)}